@@ -1,8 +1,20 @@
+import base64
+import click
+import glob
+import gzip
+import hashlib
+import json
+import mimetypes
 import os
+import queue
+import re
+import shutil
 import sqlite3
+import threading
+import time
 
-from werkzeug.utils import secure_filename
-
+from collections import OrderedDict, deque
+from concurrent.futures import Future
 from datetime import datetime, timedelta
 
 from flask import (
@@ -13,28 +25,36 @@ from flask import (
     url_for,
     abort,
     flash,
+    g,
+    jsonify,
+    send_from_directory,
     Response,
 )
+from flask.cli import AppGroup
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.utils import secure_filename
 
 
 # ============================================================
 # App setup
 # ============================================================
+# Importing this module must stay cheap and free of I/O: gunicorn --preload
+# imports it once in the master and forks workers from there. Schema setup
+# lives in init_app(), run by `flask ftb init` or the gunicorn master hook.
 app = Flask(__name__)
 app.secret_key = os.environ.get("FLASK_SECRET_KEY", "dev-secret-key")
-@app.route("/welcome")
-def welcome():
-    return render_template("welcome.html")
-@app.route("/")
-def home():
-    return redirect(url_for("welcome"))
 
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(BASE_DIR, "ftb.db")
+# behind a router (Render, Heroku) remote_addr is the proxy; trust this many
+# X-Forwarded-For hops so per-client rate limits see the real client
+if int(os.environ.get("FTB_PROXY_HOPS") or 0):
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(os.environ["FTB_PROXY_HOPS"]))
 
-UPLOAD_FOLDER = os.path.join(BASE_DIR, "static", "uploads")
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# `flask ftb ...` maintenance commands
+ftb_cli = AppGroup("ftb", help="Find the Beat maintenance commands.")
+app.cli.add_command(ftb_cli)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.environ.get("FTB_DB_PATH") or os.path.join(BASE_DIR, "ftb.db")
 
 # images + videos
 ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg", "webp", "mp4", "mov", "webm"}
@@ -44,7 +64,6 @@ app.config["MAX_CONTENT_LENGTH"] = 200 * 1024 * 1024  # 200MB
 
 UPLOAD_SUBDIR = "uploads"
 UPLOAD_FOLDER = os.path.join(app.static_folder, UPLOAD_SUBDIR)
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 ALLOWED_VIDEO_EXTS = {"mp4", "mov", "m4v", "webm"}
 
@@ -58,6 +77,9 @@ def allowed_video(filename: str) -> bool:
 def db():
     conn = sqlite3.connect(DB_PATH)
     conn.row_factory = sqlite3.Row
+    trace = app.config.get("FTB_SQL_TRACE")
+    if trace:
+        conn.set_trace_callback(trace)
     return conn
 
 
@@ -78,30 +100,173 @@ def current_user_id():
 
 
 # ============================================================
-# Schemas / migrations
+# Write path (single writer, group commit)
 # ============================================================
-def ensure_db():
-    conn = sqlite3.connect("ftb.db")
-    conn.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            email TEXT,
-            password_hash TEXT,
-            display_name TEXT,
-            role TEXT,
-            genre TEXT,
-            city TEXT,
-            state TEXT,
-            bio TEXT,
-            tags_csv TEXT,
-            instrument TEXT,
-            services_csv TEXT,
-            profile_pic TEXT
-        )
-    """)
-    conn.commit()
-    conn.close()
+# SQLite takes one writer at a time. Instead of every request opening its own
+# connection and committing, writes are queued to one writer thread per
+# process, which applies whatever has piled up in a single transaction.
+# Batches only form when a process has concurrent request threads (gunicorn
+# runs gthread workers, see gunicorn.conf.py); a lone write commits at once.
+WRITE_BATCH_WINDOW = float(os.environ.get("FTB_WRITE_BATCH_MS", "5")) / 1000
+WRITE_BATCH_MAX = int(os.environ.get("FTB_WRITE_BATCH_MAX", "64"))
+WRITE_TIMEOUT = 30  # seconds a caller waits for its batch to commit
+
+
+class WriteQueue:
+    def __init__(self, path, window=WRITE_BATCH_WINDOW, max_batch=WRITE_BATCH_MAX):
+        self.path = path
+        self.window = window
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._reset_metrics()
+
+    def _reset_metrics(self):
+        self.batches = 0
+        self.writes = 0
+        self.errors = 0
+        self._batch_sizes = deque(maxlen=1024)
+        self._waits = deque(maxlen=1024)
+
+    def _ensure_started(self):
+        # called with self._lock held. Threads don't survive fork(), and a
+        # writer that died (see _run) is replaced: each worker starts its own
+        # writer on first use and opens its connection from inside that thread
+        pid = os.getpid()
+        if self._pid == pid and self._thread is not None:
+            return
+        if self._pid != pid:
+            self._reset_metrics()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, args=(self._queue,), name="ftb-writer", daemon=True)
+        self._thread.start()
+        self._pid = pid
+
+    def submit(self, statements):
+        """Queue [(sql, params), ...] to be applied atomically; returns a Future
+        that resolves to the last statement's lastrowid once committed."""
+        fut = Future()
+        # enqueue under the lock so nothing lands on a queue whose writer has
+        # already drained it on the way out
+        with self._lock:
+            self._ensure_started()
+            self._queue.put((time.monotonic(), list(statements), fut))
+        return fut
+
+    def execute(self, sql, params=()):
+        return self.submit([(sql, params)]).result(WRITE_TIMEOUT)
+
+    def _run(self, q):
+        conn, batch = None, []
+        try:
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=WRITE_TIMEOUT, check_same_thread=False)
+            # WAL lets page reads carry on while a batch commits; synchronous
+            # stays at its FULL default so an acknowledged write is on disk
+            conn.execute("PRAGMA journal_mode=WAL")
+
+            while True:
+                batch = [q.get()]
+                # a lone write commits straight away; the window is only
+                # worth waiting out when callers are already piling up
+                deadline = time.monotonic() + self.window if not q.empty() else 0
+                while len(batch) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    try:
+                        batch.append(q.get(timeout=remaining) if remaining > 0 else q.get_nowait())
+                    except queue.Empty:
+                        break
+                self._commit(conn, batch)
+                batch = []
+        except Exception as e:
+            # connection in an unknown state: fail everything still waiting
+            # on this writer and let the next submit() start a fresh one
+            app.logger.exception("writer thread died; restarting on next write")
+            with self._lock:
+                if self._queue is q:
+                    self._thread = None
+                while True:
+                    try:
+                        batch.append(q.get_nowait())
+                    except queue.Empty:
+                        break
+            for _, _, fut in batch:
+                if not fut.done():
+                    self.errors += 1
+                    fut.set_exception(e)
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def _commit(self, conn, batch):
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for _, statements, fut in batch:
+                # a savepoint per caller: one bad write fails alone, not the batch
+                conn.execute("SAVEPOINT w")
+                try:
+                    cur = None
+                    for sql, params in statements:
+                        cur = conn.execute(sql, params)
+                    conn.execute("RELEASE w")
+                    results.append((fut, cur.lastrowid if cur else None, None))
+                except sqlite3.Error as e:
+                    conn.execute("ROLLBACK TO w")
+                    conn.execute("RELEASE w")
+                    results.append((fut, None, e))
+            conn.execute("COMMIT")
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            self.errors += len(batch)
+            for _, _, fut in batch:
+                fut.set_exception(e)
+            return
+
+        done = time.monotonic()
+        self.batches += 1
+        self.writes += len(batch)
+        self._batch_sizes.append(len(batch))
+        for enqueued, _, _ in batch:
+            self._waits.append(done - enqueued)
+
+        for fut, value, err in results:
+            if err is not None:
+                self.errors += 1
+                fut.set_exception(err)
+            else:
+                fut.set_result(value)
+
+    def stats(self):
+        def pct(values, p):
+            if not values:
+                return 0
+            ordered = sorted(values)
+            return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+        sizes, waits = list(self._batch_sizes), list(self._waits)
+        return {
+            "pid": os.getpid(),
+            "batches": self.batches,
+            "writes": self.writes,
+            "errors": self.errors,
+            "pending": self._queue.qsize() if self._queue else 0,
+            "batch_size_avg": round(sum(sizes) / len(sizes), 2) if sizes else 0,
+            "batch_size_max": max(sizes, default=0),
+            "queue_wait_ms_p50": round(pct(waits, 0.50) * 1000, 2),
+            "queue_wait_ms_p95": round(pct(waits, 0.95) * 1000, 2),
+            "queue_wait_ms_max": round(max(waits, default=0) * 1000, 2),
+        }
+
+
+writer = WriteQueue(DB_PATH)
 
+
+# ============================================================
+# Schemas / migrations
+# ============================================================
 def ensure_db():
     conn = db()
     conn.execute(
@@ -123,6 +288,15 @@ def ensure_db():
         )
         """
     )
+    # shared version stamps for per-worker caches (see UserSummaryCache)
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS cache_stamps (
+          name TEXT PRIMARY KEY,
+          version INTEGER NOT NULL
+        )
+        """
+    )
     conn.commit()
 
     # seed a user if empty
@@ -177,6 +351,14 @@ def ensure_showcases_schema():
         )
         """
     )
+    # match the ORDER BY in select_showcases() exactly so SQLite walks the
+    # index instead of sorting
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_showcases_event_order ON showcases (COALESCE(event_date,''), id)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_showcases_host ON showcases (host_user_id, COALESCE(event_date,''), id)"
+    )
     conn.commit()
     conn.close()
 
@@ -196,10 +378,507 @@ def ensure_messages_schema():
         )
         """
     )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_thread ON messages (thread_key, created_at, id)")
+    # one index per side of the inbox's from_user_id = ? OR to_user_id = ?
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_from ON messages (from_user_id, created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_to ON messages (to_user_id, created_at)")
     conn.commit()
     conn.close()
 
 
+# ============================================================
+# User summary cache (id, display_name, profile_pic)
+# ============================================================
+# Each worker keeps an LRU of summaries. Writes that change a summary bump the
+# shared "user_summary" stamp in the same transaction; every worker re-reads
+# the stamp at most once per USER_CACHE_SYNC_INTERVAL and drops its copy when
+# it has moved. The worker that made the write clears its own copy at once.
+USER_CACHE_SIZE = int(os.environ.get("FTB_USER_CACHE_SIZE", "2048"))
+USER_CACHE_SYNC_INTERVAL = float(os.environ.get("FTB_USER_CACHE_SYNC_MS", "1000")) / 1000
+USER_SUMMARY_STAMP = "user_summary"
+
+BUMP_STAMP_SQL = """
+    INSERT INTO cache_stamps (name, version) VALUES (?, 1)
+    ON CONFLICT(name) DO UPDATE SET version = version + 1
+"""
+
+
+class UserSummaryCache:
+    def __init__(self, max_size=USER_CACHE_SIZE):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+        self._version = None
+        self._next_sync = 0
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._version = None
+
+    def _sync_due(self):
+        return self._version is None or time.monotonic() >= self._next_sync
+
+    def _sync(self, conn):
+        row = conn.execute("SELECT version FROM cache_stamps WHERE name = ?", (USER_SUMMARY_STAMP,)).fetchone()
+        version = row[0] if row else 0
+        with self._lock:
+            if version != self._version:
+                self._items.clear()
+                self._version = version
+            self._next_sync = time.monotonic() + USER_CACHE_SYNC_INTERVAL
+
+    def get_many(self, ids, conn=None):
+        """Return {id: {"id", "display_name", "profile_pic"}} for the ids that
+        exist, reading all misses with a single IN (...) query."""
+        ids = {int(i) for i in ids if i is not None}
+        if not ids:
+            return {}
+
+        # only touch the DB for a due stamp check or a miss: a warm hit
+        # costs no connection and no query
+        own_conn = False
+        try:
+            if self._sync_due():
+                if conn is None:
+                    conn, own_conn = db(), True
+                self._sync(conn)
+            found, missing = {}, []
+            with self._lock:
+                version = self._version
+                for i in ids:
+                    if i in self._items:
+                        self._items.move_to_end(i)
+                        found[i] = self._items[i]
+                    else:
+                        missing.append(i)
+            self.hits += len(found)
+            self.misses += len(missing)
+            if missing and conn is None:
+                conn, own_conn = db(), True
+
+            # stay well under SQLite's bound-parameter limit
+            for start in range(0, len(missing), 500):
+                chunk = missing[start : start + 500]
+                rows = conn.execute(
+                    f"SELECT id, display_name, profile_pic FROM users WHERE id IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                for r in rows:
+                    found[r["id"]] = dict(r)
+        finally:
+            if own_conn:
+                conn.close()
+
+        with self._lock:
+            if version != self._version:
+                # another request saw a newer stamp while we were reading
+                return found
+            for i in missing:
+                if i in found:
+                    self._items[i] = found[i]
+                    self._items.move_to_end(i)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+        return found
+
+    def get(self, user_id, conn=None):
+        return self.get_many([user_id], conn).get(int(user_id))
+
+
+user_cache = UserSummaryCache()
+
+
+# ============================================================
+# Shared queries (HTML pages + JSON API)
+# ============================================================
+# field name -> SELECT expression. Only names from these maps ever reach SQL,
+# so ?fields= can be pushed straight into the SELECT list.
+USER_COLUMNS = {
+    f: f
+    for f in (
+        "id",
+        "display_name",
+        "role",
+        "genre",
+        "city",
+        "state",
+        "bio",
+        "tags_csv",
+        "instrument",
+        "services_csv",
+        "profile_pic",
+    )
+}
+
+SHOWCASE_COLUMNS = {
+    f: f
+    for f in (
+        "id",
+        "title",
+        "event_date",
+        "event_time",
+        "city",
+        "address",
+        "venue",
+        "description",
+        "poster_path",
+        "video_path",
+        "host_user_id",
+        "host_name",
+        "performers_csv",
+        "performer_user_ids_csv",
+        "ticket_url",
+        "created_at",
+    )
+}
+
+MESSAGE_COLUMNS = {
+    "id": "m.id",
+    "thread_key": "m.thread_key",
+    "from_user_id": "m.from_user_id",
+    "to_user_id": "m.to_user_id",
+    "body": "m.body",
+    "showcase_id": "m.showcase_id",
+    "created_at": "m.created_at",
+}
+
+# filled in from the user-summary cache rather than joined per message;
+# value = the message columns with_user_names() needs to resolve them
+MESSAGE_USER_FIELDS = {f: ("from_user_id", "to_user_id") for f in ("from_name", "from_pic", "to_name")}
+
+
+def select_list(columns, fields):
+    return ", ".join(columns[f] for f in fields)
+
+
+def select_user(conn, user_id, fields):
+    return conn.execute(
+        f"SELECT {select_list(USER_COLUMNS, fields)} FROM users WHERE id = ?",
+        (user_id,),
+    ).fetchone()
+
+
+def select_people(conn, fields, before_id=None, limit=None):
+    # newest first; (before_id) is the keyset cursor for the API
+    sql = f"SELECT {select_list(USER_COLUMNS, fields)} FROM users"
+    params = []
+    if before_id is not None:
+        sql += " WHERE id < ?"
+        params.append(before_id)
+    sql += " ORDER BY id DESC"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return conn.execute(sql, params).fetchall()
+
+
+def select_showcase(conn, showcase_id, fields):
+    return conn.execute(
+        f"SELECT {select_list(SHOWCASE_COLUMNS, fields)} FROM showcases WHERE id = ?",
+        (showcase_id,),
+    ).fetchone()
+
+
+def select_showcases(conn, fields, host_user_id=None, after=None, limit=None):
+    # (after) is (COALESCE(event_date,''), id) of the last row already seen
+    sql = f"SELECT {select_list(SHOWCASE_COLUMNS, fields)} FROM showcases"
+    where, params = [], []
+    if host_user_id is not None:
+        where.append("host_user_id = ?")
+        params.append(host_user_id)
+    if after is not None:
+        # the plain <= gives SQLite a range to seek on the ordering index;
+        # the row-value comparison then breaks ties on id
+        where.append("COALESCE(event_date,'') <= ? AND (COALESCE(event_date,''), id) < (?, ?)")
+        params.extend([after[0], *after])
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY COALESCE(event_date,'') DESC, id DESC"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return conn.execute(sql, params).fetchall()
+
+
+def select_inbox(conn, me, fields, before=None, limit=None):
+    # latest message per thread, newest thread first. With a lone MAX()
+    # aggregate SQLite takes the bare columns from the max row; (before) is
+    # (created_at, id) of the last thread already seen
+    sql = f"""
+        SELECT * FROM (
+          SELECT {select_list(MESSAGE_COLUMNS, fields)}, MAX(m.created_at) AS latest_at
+          FROM messages m
+          WHERE m.from_user_id = ? OR m.to_user_id = ?
+          GROUP BY m.thread_key
+        )
+        """
+    params = [me, me]
+    if before is not None:
+        sql += " WHERE (created_at, id) < (?, ?)"
+        params.extend(before)
+    sql += " ORDER BY created_at DESC, id DESC"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return conn.execute(sql, params).fetchall()
+
+
+def with_user_names(rows, conn=None):
+    # one cache lookup for every sender/recipient on the page
+    ids = {r["from_user_id"] for r in rows} | {r["to_user_id"] for r in rows}
+    users = user_cache.get_many(ids, conn)
+    out = []
+    for r in rows:
+        d = dict(r)
+        sender = users.get(d["from_user_id"]) or {}
+        d["from_name"] = sender.get("display_name")
+        d["from_pic"] = sender.get("profile_pic")
+        d["to_name"] = (users.get(d["to_user_id"]) or {}).get("display_name")
+        out.append(d)
+    return out
+
+
+def select_thread(conn, thread_key, fields, after=None, limit=None):
+    # oldest first; (after) is (created_at, id) of the last message already seen
+    sql = f"""
+        SELECT {select_list(MESSAGE_COLUMNS, fields)}
+        FROM messages m
+        WHERE m.thread_key = ?
+        """
+    params = [thread_key]
+    if after is not None:
+        sql += " AND (m.created_at, m.id) > (?, ?)"
+        params.extend(after)
+    sql += " ORDER BY m.created_at ASC, m.id ASC"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return conn.execute(sql, params).fetchall()
+
+
+def iter_upload_refs(conn):
+    # every static/ path the DB points at under uploads/, streamed from the cursor
+    cur = conn.execute(
+        """
+        SELECT profile_pic AS path FROM users WHERE profile_pic LIKE 'uploads/%'
+        UNION
+        SELECT poster_path FROM showcases WHERE poster_path LIKE 'uploads/%'
+        UNION
+        SELECT video_path FROM showcases WHERE video_path LIKE 'uploads/%'
+        """
+    )
+    for (path,) in cur:
+        yield path
+
+
+def iter_upload_owners(conn):
+    # (kind, id, path) for every uploads/ reference, in one streaming pass
+    cur = conn.execute(
+        """
+        SELECT 'user', id, profile_pic FROM users WHERE profile_pic LIKE 'uploads/%'
+        UNION ALL
+        SELECT 'showcase', id, poster_path FROM showcases WHERE poster_path LIKE 'uploads/%'
+        UNION ALL
+        SELECT 'showcase', id, video_path FROM showcases WHERE video_path LIKE 'uploads/%'
+        """
+    )
+    yield from cur
+
+
+# ============================================================
+# Rate limiting + upload admission
+# ============================================================
+# Token buckets (per client and global) and the in-flight upload slots live
+# in a small SQLite file of their own, so every gunicorn worker on the host
+# shares them without contending with ftb.db. Checks run in before_request,
+# i.e. before anything touches request.form/files, so a rejected request
+# gets its 429/503 without its body being read.
+RATE_DB_PATH = os.environ.get("FTB_RATE_DB_PATH") or os.path.join(BASE_DIR, "ftb-ratelimit.db")
+
+# kind -> ((per-client tokens/sec, burst), (global tokens/sec, burst))
+RATE_LIMITS = {
+    "messages": ((0.5, 10), (20, 200)),
+    "uploads": ((0.05, 5), (1, 20)),
+    "profile": ((0.5, 20), (20, 200)),
+}
+# POST endpoints -> bucket kind; everything else (page views) is never limited
+RATE_LIMITED_ENDPOINTS = {
+    "message_new": "messages",
+    "message_thread": "messages",
+    "showcase_new": "uploads",
+    "profile": "profile",
+}
+# the profile form is always multipart; only a body bigger than the text
+# fields alone (i.e. one carrying a photo or clip) is charged as an upload
+PROFILE_FORM_BYTES = 64 * 1024
+
+LARGE_UPLOAD_BYTES = 5 * 1024 * 1024
+MAX_LARGE_UPLOADS = int(os.environ.get("FTB_MAX_LARGE_UPLOADS", "2"))
+UPLOAD_SLOT_TTL = 15 * 60  # seconds before an abandoned slot is reclaimed
+UPLOAD_RETRY_AFTER = 10
+
+
+class RateStore:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._takes = 0
+
+    def _db(self):
+        # one connection per process, opened after fork
+        if self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=0.5, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # bucket state is disposable; don't pay for fsyncs
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS upload_slots (
+                  id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  pid INTEGER NOT NULL,
+                  started REAL NOT NULL
+                )
+                """
+            )
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def take(self, limits):
+        """Take one token from every (key, rate, burst) bucket, or from none.
+        Returns 0 when allowed, else the seconds until it would be."""
+        now = time.time()
+        with self._lock:
+            conn = self._db()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                levels, wait = [], 0
+                for key, rate, burst in limits:
+                    row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+                    tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+                    if tokens < 1:
+                        wait = max(wait, (1 - tokens) / rate)
+                    levels.append((key, tokens - 1))
+                if not wait:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                        [(key, tokens, now) for key, tokens in levels],
+                    )
+                self._takes += 1
+                if self._takes % 1000 == 0:
+                    # idle clients have refilled long ago; forget them
+                    conn.execute("DELETE FROM buckets WHERE updated < ?", (now - 3600,))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return wait
+
+    def acquire_upload_slot(self, cap):
+        now = time.time()
+        with self._lock:
+            conn = self._db()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM upload_slots WHERE started < ?", (now - UPLOAD_SLOT_TTL,))
+                for slot_id, pid in conn.execute("SELECT id, pid FROM upload_slots").fetchall():
+                    if not pid_alive(pid):
+                        conn.execute("DELETE FROM upload_slots WHERE id = ?", (slot_id,))
+                n = conn.execute("SELECT COUNT(*) FROM upload_slots").fetchone()[0]
+                slot = None
+                if n < cap:
+                    slot = conn.execute(
+                        "INSERT INTO upload_slots (pid, started) VALUES (?, ?)", (os.getpid(), now)
+                    ).lastrowid
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return slot
+
+    def release_upload_slot(self, slot):
+        with self._lock:
+            self._db().execute("DELETE FROM upload_slots WHERE id = ?", (slot,))
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+rate_store = RateStore(RATE_DB_PATH)
+
+
+def too_busy(status, retry_after, message):
+    resp = Response(message, status=status, mimetype="text/plain")
+    resp.headers["Retry-After"] = str(max(1, int(retry_after + 0.999)))
+    return resp
+
+
+@app.before_request
+def admit_request():
+    kind = RATE_LIMITED_ENDPOINTS.get(request.endpoint)
+    if request.method != "POST" or not kind:
+        return None
+    if kind == "profile" and request.mimetype == "multipart/form-data":
+        if request.content_length is None or request.content_length > PROFILE_FORM_BYTES:
+            kind = "uploads"
+
+    # the upload slot comes first: a 503 for server-side capacity shouldn't
+    # also cost the client tokens. Chunked bodies have no Content-Length;
+    # treat them as large. A slot taken here is released at teardown, even
+    # if the buckets then turn the request away
+    length = request.content_length
+    if kind == "uploads" and (length is None or length > LARGE_UPLOAD_BYTES):
+        try:
+            slot = rate_store.acquire_upload_slot(MAX_LARGE_UPLOADS)
+        except sqlite3.Error:
+            app.logger.exception("upload admission unavailable")
+        else:
+            if slot is None:
+                return too_busy(503, UPLOAD_RETRY_AFTER, "Lots of uploads in progress — try again shortly.")
+            g.upload_slot = slot
+
+    (client_rate, client_burst), (global_rate, global_burst) = RATE_LIMITS[kind]
+    try:
+        wait = rate_store.take(
+            [
+                (f"{kind}:{request.remote_addr}", client_rate, client_burst),
+                (f"{kind}:*", global_rate, global_burst),
+            ]
+        )
+    except sqlite3.Error:
+        # the limiter must never take the site down with it: fail open
+        app.logger.exception("rate limiter unavailable")
+        return None
+    if wait:
+        return too_busy(429, wait, "Slow down a little — try again in a moment.")
+    return None
+
+
+@app.teardown_request
+def release_upload_slot(exc):
+    slot = g.pop("upload_slot", None)
+    if slot is not None:
+        try:
+            rate_store.release_upload_slot(slot)
+        except sqlite3.Error:
+            # reclaimed by UPLOAD_SLOT_TTL instead
+            app.logger.exception("could not release upload slot %s", slot)
+
+
 # ============================================================
 # Landing / Search
 # ============================================================
@@ -217,13 +896,10 @@ def home():
     q = (request.args.get("q") or "").strip().lower()
 
     conn = db()
-    rows = conn.execute(
-        """
-        SELECT id, display_name, role, genre, city, state, instrument, services_csv, profile_pic
-        FROM users
-        ORDER BY id DESC
-        """
-    ).fetchall()
+    rows = select_people(
+        conn,
+        ("id", "display_name", "role", "genre", "city", "state", "instrument", "services_csv", "profile_pic"),
+    )
     conn.close()
 
     people = []
@@ -288,9 +964,8 @@ def profile():
             file.save(save_path)
             profile_pic_path = f"uploads/{filename}"
 
-        conn = db()
         if profile_pic_path:
-            conn.execute(
+            update = (
                 """
                 UPDATE users
                 SET display_name=?, role=?, genre=?, city=?, state=?, bio=?, instrument=?, services_csv=?, tags_csv=?, profile_pic=?
@@ -311,7 +986,7 @@ def profile():
                 ),
             )
         else:
-            conn.execute(
+            update = (
                 """
                 UPDATE users
                 SET display_name=?, role=?, genre=?, city=?, state=?, bio=?, instrument=?, services_csv=?, tags_csv=?
@@ -330,20 +1005,16 @@ def profile():
                     user_id,
                 ),
             )
-        conn.commit()
-        conn.close()
+        # bump the stamp in the same transaction so every worker's
+        # user-summary cache drops the old name/picture
+        writer.submit([update, (BUMP_STAMP_SQL, (USER_SUMMARY_STAMP,))]).result(WRITE_TIMEOUT)
+        user_cache.clear()
 
         flash("Profile saved ✅")
         return redirect(url_for("profile"))
 
     conn = db()
-    user = conn.execute(
-        """
-        SELECT id, display_name, role, genre, city, state, bio, tags_csv, instrument, services_csv, profile_pic
-        FROM users WHERE id=?
-        """,
-        (user_id,),
-    ).fetchone()
+    user = select_user(conn, user_id, tuple(USER_COLUMNS))
     conn.close()
 
     if not user:
@@ -357,23 +1028,18 @@ def profile():
 # ============================================================
 @app.route("/u/<int:user_id>")
 def user_detail(user_id):
-    ensure_showcases_schema()
 
     conn = db()
-    row = conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
+    row = select_user(conn, user_id, tuple(USER_COLUMNS))
     if not row:
         conn.close()
         abort(404)
 
-    showcases = conn.execute(
-        """
-        SELECT id, title, event_date, event_time, city, poster_path
-        FROM showcases
-        WHERE host_user_id = ?
-        ORDER BY COALESCE(event_date,'') DESC, id DESC
-        """,
-        (user_id,),
-    ).fetchall()
+    showcases = select_showcases(
+        conn,
+        ("id", "title", "event_date", "event_time", "city", "poster_path"),
+        host_user_id=user_id,
+    )
     conn.close()
 
     user = dict(row)
@@ -406,13 +1072,10 @@ def category(kind):
         return redirect(url_for("showcases_list"))
 
     conn = db()
-    rows = conn.execute(
-        """
-        SELECT id, display_name, role, genre, city, state, instrument, services_csv, profile_pic
-        FROM users
-        ORDER BY id DESC
-        """
-    ).fetchall()
+    rows = select_people(
+        conn,
+        ("id", "display_name", "role", "genre", "city", "state", "instrument", "services_csv", "profile_pic"),
+    )
     conn.close()
 
     title_map = {
@@ -445,13 +1108,7 @@ def production_people(job):
     key = job_raw.lower()
 
     conn = db()
-    rows = conn.execute(
-        """
-        SELECT id, display_name, city, state, services_csv, role, genre, profile_pic
-        FROM users
-        ORDER BY id DESC
-        """
-    ).fetchall()
+    rows = select_people(conn, ("id", "display_name", "city", "state", "services_csv", "role", "genre", "profile_pic"))
     conn.close()
 
     def first_name(dn: str):
@@ -482,16 +1139,11 @@ def production_people(job):
 # ============================================================
 @app.route("/c/showcases")
 def showcases_list():
-    ensure_showcases_schema()
 
     conn = db()
-    rows = conn.execute(
-        """
-        SELECT id, title, event_date, event_time, city, venue, poster_path, host_name
-        FROM showcases
-        ORDER BY COALESCE(event_date,'') DESC, id DESC
-        """
-    ).fetchall()
+    rows = select_showcases(
+        conn, ("id", "title", "event_date", "event_time", "city", "venue", "poster_path", "host_name")
+    )
     conn.close()
 
     showcases = []
@@ -514,10 +1166,9 @@ def showcases_list():
 
 @app.route("/s/<int:showcase_id>")
 def showcase_detail(showcase_id):
-    ensure_showcases_schema()
 
     conn = db()
-    r = conn.execute("SELECT * FROM showcases WHERE id = ?", (showcase_id,)).fetchone()
+    r = select_showcase(conn, showcase_id, tuple(SHOWCASE_COLUMNS))
     conn.close()
     if not r:
         abort(404)
@@ -527,16 +1178,17 @@ def showcase_detail(showcase_id):
 
     linked_performers = []
     if linked_ids:
-        conn = db()
+        uids = []
         for pid in linked_ids:
             try:
-                uid = int(pid)
+                uids.append(int(pid))
             except:
                 continue
-            u = conn.execute("SELECT id, display_name FROM users WHERE id=?", (uid,)).fetchone()
+        users = user_cache.get_many(uids)
+        for uid in uids:
+            u = users.get(uid)
             if u:
                 linked_performers.append({"id": u["id"], "display_name": u["display_name"]})
-        conn.close()
 
     showcase = {
         "id": r["id"],
@@ -562,7 +1214,6 @@ def showcase_detail(showcase_id):
 
 @app.route("/s/<int:showcase_id>/calendar.ics")
 def showcase_ics(showcase_id):
-    ensure_showcases_schema()
 
     conn = db()
     r = conn.execute(
@@ -613,7 +1264,6 @@ END:VCALENDAR
 
 @app.route("/showcases/new", methods=["GET", "POST"])
 def showcase_new():
-    ensure_showcases_schema()
 
     if request.method == "POST":
         title = (request.form.get("title") or "").strip()
@@ -651,8 +1301,7 @@ def showcase_new():
             video.save(vsave)
             video_path = f"uploads/{vname}"
 
-        conn = db()
-        conn.execute(
+        writer.execute(
             """
             INSERT INTO showcases (
               title, event_date, event_time, city, address, venue, description,
@@ -679,8 +1328,6 @@ def showcase_new():
                 datetime.utcnow().isoformat(),
             ),
         )
-        conn.commit()
-        conn.close()
 
         flash("Showcase posted ✅")
         return redirect(url_for("showcases_list"))
@@ -693,38 +1340,21 @@ def showcase_new():
 # ============================================================
 @app.route("/inbox")
 def inbox():
-    ensure_messages_schema()
     me = current_user_id()
 
     conn = db()
-    rows = conn.execute(
-        """
-        SELECT m.id, m.thread_key, m.body, m.created_at, m.showcase_id,
-               m.from_user_id, m.to_user_id,
-               u1.display_name AS from_name,
-               u2.display_name AS to_name
-        FROM messages m
-        LEFT JOIN users u1 ON u1.id = m.from_user_id
-        LEFT JOIN users u2 ON u2.id = m.to_user_id
-        WHERE m.from_user_id = ? OR m.to_user_id = ?
-        ORDER BY m.created_at DESC
-        """,
-        (me, me),
-    ).fetchall()
+    rows = select_inbox(
+        conn,
+        me,
+        ("id", "thread_key", "body", "created_at", "showcase_id", "from_user_id", "to_user_id"),
+    )
+    threads = with_user_names(rows, conn)
     conn.close()
-
-    latest = {}
-    for r in rows:
-        if r["thread_key"] not in latest:
-            latest[r["thread_key"]] = dict(r)
-
-    threads = list(latest.values())
     return render_template("inbox.html", threads=threads, me=me)
 
 
 @app.route("/messages/new", methods=["GET", "POST"])
 def message_new():
-    ensure_messages_schema()
     me = current_user_id()
 
     to_user_id = request.args.get("to") or request.form.get("to_user_id") or ""
@@ -744,21 +1374,18 @@ def message_new():
         if showcase_id_val:
             thread_key = f"{thread_key}_s{showcase_id_val}"
 
-        conn = db()
-        conn.execute(
+        writer.execute(
             """
             INSERT INTO messages (thread_key, from_user_id, to_user_id, body, showcase_id, created_at)
             VALUES (?, ?, ?, ?, ?, ?)
             """,
             (thread_key, me, to_user_id_int, body, showcase_id_val, datetime.utcnow().isoformat()),
         )
-        conn.commit()
-        conn.close()
 
         return redirect(url_for("message_thread", thread_key=thread_key))
 
     conn = db()
-    people = conn.execute("SELECT id, display_name, profile_pic FROM users ORDER BY id DESC").fetchall()
+    people = select_people(conn, ("id", "display_name", "profile_pic"))
     conn.close()
 
     return render_template("message_new.html", people=people, to_user_id=str(to_user_id), showcase_id=str(showcase_id))
@@ -766,7 +1393,6 @@ def message_new():
 
 @app.route("/messages/<thread_key>", methods=["GET", "POST"])
 def message_thread(thread_key):
-    ensure_messages_schema()
     me = current_user_id()
 
     if request.method == "POST":
@@ -776,32 +1402,18 @@ def message_thread(thread_key):
         showcase_id = int(showcase_id) if showcase_id else None
 
         if body and to_user_id:
-            conn = db()
-            conn.execute(
+            writer.execute(
                 """
                 INSERT INTO messages (thread_key, from_user_id, to_user_id, body, showcase_id, created_at)
                 VALUES (?, ?, ?, ?, ?, ?)
                 """,
                 (thread_key, me, to_user_id, body, showcase_id, datetime.utcnow().isoformat()),
             )
-            conn.commit()
-            conn.close()
 
         return redirect(url_for("message_thread", thread_key=thread_key))
 
     conn = db()
-    msgs = conn.execute(
-        """
-        SELECT m.*, u1.display_name AS from_name, u1.profile_pic AS from_pic,
-                  u2.display_name AS to_name
-        FROM messages m
-        LEFT JOIN users u1 ON u1.id = m.from_user_id
-        LEFT JOIN users u2 ON u2.id = m.to_user_id
-        WHERE m.thread_key = ?
-        ORDER BY m.created_at ASC
-        """,
-        (thread_key,),
-    ).fetchall()
+    msgs = with_user_names(select_thread(conn, thread_key, tuple(MESSAGE_COLUMNS)), conn)
 
     other_id = None
     for m in msgs:
@@ -814,7 +1426,7 @@ def message_thread(thread_key):
 
     other = None
     if other_id:
-        other = conn.execute("SELECT id, display_name, profile_pic FROM users WHERE id=?", (other_id,)).fetchone()
+        other = user_cache.get(other_id, conn)
 
     conn.close()
 
@@ -824,34 +1436,882 @@ def message_thread(thread_key):
 def inject_user_pic():
     # if you're hardcoding user_id=1 for now
     try:
-        conn = db()
-        r = conn.execute("SELECT profile_pic FROM users WHERE id=1").fetchone()
-        conn.close()
-        pic = r["profile_pic"] if r and r["profile_pic"] else ""
+        u = user_cache.get(current_user_id())
+        pic = u["profile_pic"] if u and u["profile_pic"] else ""
     except Exception:
         pic = ""
     return {"user_pic": pic}
 
 
+# ============================================================
+# JSON API (v1) for mobile clients
+# ============================================================
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 200
+
+
+def api_error(status, message):
+    resp = jsonify({"error": message})
+    resp.status_code = status
+    return resp
+
+
+def api_fields(columns, required=("id",), derived=None):
+    # returns (fields to SELECT, fields to return); ?fields=a,b narrows both.
+    # (derived) fields aren't columns: they map to the columns they're built from
+    derived = derived or {}
+    raw = request.args.get("fields")
+    if not raw:
+        wanted = [*columns, *derived]
+    else:
+        wanted = parse_csv(raw)
+        unknown = [f for f in wanted if f not in columns and f not in derived]
+        if unknown:
+            abort(api_error(400, f"unknown fields: {', '.join(unknown)}"))
+    selected = [f for f in wanted if f in columns]
+    for f in wanted:
+        selected.extend(derived.get(f, ()))
+    selected = list(dict.fromkeys([*selected, *required]))
+    return selected, wanted
+
+
+def api_limit():
+    try:
+        n = int(request.args.get("limit") or API_PAGE_SIZE)
+    except ValueError:
+        abort(api_error(400, "limit must be an integer"))
+    return max(1, min(n, API_MAX_PAGE_SIZE))
+
+
+def encode_cursor(values):
+    raw = json.dumps(list(values), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(types):
+    # (types) is the expected type of each cursor element, e.g. (str, int)
+    token = request.args.get("cursor")
+    if not token:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+    except ValueError:
+        abort(api_error(400, "bad cursor"))
+    if (
+        not isinstance(values, list)
+        or len(values) != len(types)
+        or not all(type(v) is t for v, t in zip(values, types))
+    ):
+        abort(api_error(400, "bad cursor"))
+    return values
+
+
+def api_respond(rows, fields, next_cursor=None, many=True):
+    # the ETag is a hash of the raw row values, so a matching If-None-Match
+    # answers 304 before any dict building or JSON encoding happens
+    digest = hashlib.sha1(repr((fields, next_cursor, [tuple(r[f] for f in fields) for r in rows])).encode())
+    etag = digest.hexdigest()
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+    else:
+        items = [{f: r[f] for f in fields} for r in rows]
+        if many:
+            resp = jsonify({"data": items, "next_cursor": next_cursor})
+        else:
+            resp = jsonify({"data": items[0]})
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
+
+
+def page(rows, limit, cursor_of):
+    # rows were fetched with LIMIT limit+1; the extra row only signals "more"
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(cursor_of(rows[-1]))
+    return rows, None
+
+
+@app.route("/api/v1/people")
+def api_people():
+    selected, wanted = api_fields(USER_COLUMNS)
+    limit = api_limit()
+    cursor = decode_cursor((int,))
+
+    conn = db()
+    rows = select_people(conn, selected, before_id=cursor[0] if cursor else None, limit=limit + 1)
+    conn.close()
+
+    rows, next_cursor = page(rows, limit, lambda r: (r["id"],))
+    return api_respond(rows, wanted, next_cursor)
+
+
+@app.route("/api/v1/users/<int:user_id>")
+def api_user(user_id):
+    selected, wanted = api_fields(USER_COLUMNS)
+
+    conn = db()
+    row = select_user(conn, user_id, selected)
+    conn.close()
+
+    if not row:
+        return api_error(404, "user not found")
+    return api_respond([row], wanted, many=False)
+
+
+@app.route("/api/v1/showcases")
+def api_showcases():
+    selected, wanted = api_fields(SHOWCASE_COLUMNS, required=("id", "event_date"))
+    limit = api_limit()
+    cursor = decode_cursor((str, int))
+    host = request.args.get("host", type=int)
+
+    conn = db()
+    rows = select_showcases(conn, selected, host_user_id=host, after=cursor, limit=limit + 1)
+    conn.close()
+
+    rows, next_cursor = page(rows, limit, lambda r: (r["event_date"] or "", r["id"]))
+    return api_respond(rows, wanted, next_cursor)
+
+
+@app.route("/api/v1/showcases/<int:showcase_id>")
+def api_showcase(showcase_id):
+    selected, wanted = api_fields(SHOWCASE_COLUMNS)
+
+    conn = db()
+    row = select_showcase(conn, showcase_id, selected)
+    conn.close()
+
+    if not row:
+        return api_error(404, "showcase not found")
+    return api_respond([row], wanted, many=False)
+
+
+@app.route("/api/v1/inbox")
+def api_inbox():
+    me = current_user_id()
+    selected, wanted = api_fields(
+        MESSAGE_COLUMNS, required=("id", "created_at"), derived=MESSAGE_USER_FIELDS
+    )
+    limit = api_limit()
+    cursor = decode_cursor((str, int))
+
+    conn = db()
+    rows = select_inbox(conn, me, selected, before=cursor, limit=limit + 1)
+    threads, next_cursor = page(rows, limit, lambda r: (r["created_at"], r["id"]))
+    if any(f in MESSAGE_USER_FIELDS for f in wanted):
+        threads = with_user_names(threads, conn)
+    conn.close()
+
+    return api_respond(threads, wanted, next_cursor)
+
+
+@app.route("/api/v1/threads/<thread_key>")
+def api_thread(thread_key):
+    selected, wanted = api_fields(MESSAGE_COLUMNS, required=("id", "created_at"), derived=MESSAGE_USER_FIELDS)
+    limit = api_limit()
+    cursor = decode_cursor((str, int))
+
+    conn = db()
+    rows = select_thread(conn, thread_key, selected, after=cursor, limit=limit + 1)
+    rows, next_cursor = page(rows, limit, lambda r: (r["created_at"], r["id"]))
+    if any(f in MESSAGE_USER_FIELDS for f in wanted):
+        rows = with_user_names(rows, conn)
+    conn.close()
+
+    return api_respond(rows, wanted, next_cursor)
+
+
+@app.route("/metrics/writes")
+def write_metrics():
+    # per-process: each gunicorn worker reports its own writer
+    return jsonify(writer.stats())
+
+
+# ============================================================
+# Backups (online snapshots + restore)
+# ============================================================
+# Snapshots are taken with SQLite's online backup API a few pages at a time,
+# sleeping between steps so web workers keep getting the DB lock. If writes
+# keep restarting the copy, it falls back to VACUUM INTO, which reads in one
+# WAL snapshot and never blocks writers.
+BACKUP_DIR = os.environ.get("FTB_BACKUP_DIR") or os.path.join(BASE_DIR, "backups")
+BACKUP_KEEP = int(os.environ.get("FTB_BACKUP_KEEP", "14"))
+BACKUP_PAGES_PER_STEP = 256
+BACKUP_STEP_SLEEP = 0.02  # seconds
+BACKUP_MAX_RESTARTS = 5
+BACKUP_CHUNK = 1024 * 1024
+
+
+class BackupRestarted(Exception):
+    pass
+
+
+def copy_db_online(dst_path):
+    src = sqlite3.connect(DB_PATH)
+    dst = sqlite3.connect(dst_path)
+    state = {"remaining": None, "restarts": 0}
+
+    def progress(status, remaining, total):
+        # a write from another connection sends the copy back to page 1
+        if state["remaining"] is not None and remaining > state["remaining"]:
+            state["restarts"] += 1
+            if state["restarts"] > BACKUP_MAX_RESTARTS:
+                raise BackupRestarted()
+        state["remaining"] = remaining
+        time.sleep(BACKUP_STEP_SLEEP)
+
+    try:
+        src.backup(dst, pages=BACKUP_PAGES_PER_STEP, progress=progress)
+        return "backup"
+    except BackupRestarted:
+        dst.close()
+        os.remove(dst_path)
+        src.execute("VACUUM INTO ?", (dst_path,))
+        return "vacuum"
+    finally:
+        dst.close()
+        src.close()
+
+
+def list_snapshots():
+    # names carry a UTC timestamp, so lexical order is age order (oldest first)
+    return sorted(glob.glob(os.path.join(BACKUP_DIR, "ftb-*.db.gz")))
+
+
+def manifest_path(snapshot):
+    return snapshot[: -len(".db.gz")] + ".manifest.json"
+
+
+def prune_snapshots(keep):
+    removed = []
+    for snapshot in list_snapshots()[:-keep] if keep > 0 else []:
+        for path in (snapshot, manifest_path(snapshot)):
+            if os.path.exists(path):
+                os.remove(path)
+        removed.append(snapshot)
+    return removed
+
+
+def make_snapshot(keep=BACKUP_KEEP):
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+    snapshot = os.path.join(BACKUP_DIR, f"ftb-{stamp}.db.gz")
+    raw = snapshot + ".raw.tmp"
+
+    # a failure anywhere (busy lock, full disk) must not leave partial files
+    # behind for the next run to trip over
+    try:
+        method = copy_db_online(raw)
+
+        # the upload manifest comes from the copy, so it matches the snapshot
+        # exactly and costs the live DB nothing
+        conn = sqlite3.connect(raw)
+        uploads = []
+        for path in iter_upload_refs(conn):
+            full = os.path.join(app.static_folder, path)
+            try:
+                uploads.append({"path": path, "bytes": os.path.getsize(full)})
+            except OSError:
+                uploads.append({"path": path, "bytes": None, "missing": True})
+        conn.close()
+
+        digest = hashlib.sha256()
+        db_bytes = 0
+        with open(raw, "rb") as fin, gzip.open(snapshot + ".tmp", "wb") as fout:
+            while True:
+                chunk = fin.read(BACKUP_CHUNK)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                db_bytes += len(chunk)
+                fout.write(chunk)
+        os.replace(snapshot + ".tmp", snapshot)
+
+        manifest = {
+            "snapshot": os.path.basename(snapshot),
+            "created_at": datetime.utcnow().isoformat(),
+            "method": method,
+            "db_bytes": db_bytes,
+            "db_sha256": digest.hexdigest(),
+            "uploads": uploads,
+        }
+        with open(manifest_path(snapshot) + ".tmp", "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(manifest_path(snapshot) + ".tmp", manifest_path(snapshot))
+    finally:
+        for tmp in (raw, snapshot + ".tmp", manifest_path(snapshot) + ".tmp"):
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    prune_snapshots(keep)
+    return snapshot, manifest
+
+
+def stamp_version(conn):
+    try:
+        row = conn.execute("SELECT version FROM cache_stamps WHERE name = ?", (USER_SUMMARY_STAMP,)).fetchone()
+    except sqlite3.OperationalError:
+        # snapshot or DB from before cache_stamps existed
+        return 0
+    return row[0] if row else 0
+
+
+def restore_snapshot(snapshot):
+    manifest = None
+    if os.path.exists(manifest_path(snapshot)):
+        with open(manifest_path(snapshot)) as f:
+            manifest = json.load(f)
+
+    raw = snapshot + ".restore.tmp"
+    digest = hashlib.sha256()
+    with gzip.open(snapshot, "rb") as fin, open(raw, "wb") as fout:
+        while True:
+            chunk = fin.read(BACKUP_CHUNK)
+            if not chunk:
+                break
+            digest.update(chunk)
+            fout.write(chunk)
+
+    try:
+        if manifest and manifest["db_sha256"] != digest.hexdigest():
+            raise click.ClickException(f"{snapshot} does not match its manifest checksum")
+
+        src = sqlite3.connect(raw)
+        try:
+            if src.execute("PRAGMA integrity_check").fetchone()[0] != "ok":
+                raise click.ClickException(f"{snapshot} failed PRAGMA integrity_check")
+            # copy into the live file through SQLite so open connections see
+            # a consistent switch instead of a file swapped underneath them
+            live = sqlite3.connect(DB_PATH, timeout=WRITE_TIMEOUT)
+            # the snapshot brings back its own, older stamp; move past both so
+            # no worker mistakes the restored rows for what it already holds
+            held = stamp_version(live)
+            src.backup(live)
+            live.execute(
+                "INSERT OR REPLACE INTO cache_stamps (name, version) VALUES (?, ?)",
+                (USER_SUMMARY_STAMP, max(held, stamp_version(live)) + 1),
+            )
+            live.commit()
+            live.close()
+        finally:
+            src.close()
+    finally:
+        os.remove(raw)
+
+    missing = []
+    for entry in (manifest or {}).get("uploads", []):
+        if not os.path.exists(os.path.join(app.static_folder, entry["path"])):
+            missing.append(entry["path"])
+    return missing
+
+
+@ftb_cli.command("backup")
+@click.option("--every", type=int, default=0, help="Keep running and take a snapshot every N seconds.")
+@click.option("--keep", type=int, default=BACKUP_KEEP, show_default=True, help="Snapshots to retain.")
+def backup_command(every, keep):
+    """Write a compressed, timestamped snapshot of the DB to the backup dir."""
+    while True:
+        started = time.monotonic()
+        try:
+            snapshot, manifest = make_snapshot(keep)
+        except Exception:
+            if every <= 0:
+                raise
+            # one bad run (busy lock, full disk) mustn't stop the schedule
+            app.logger.exception("backup failed; retrying in %ss", every)
+        else:
+            click.echo(
+                f"{snapshot} ({manifest['method']}, {manifest['db_bytes']} bytes, "
+                f"{len(manifest['uploads'])} uploads, {time.monotonic() - started:.1f}s)"
+            )
+        if every <= 0:
+            return
+        time.sleep(max(0, every - (time.monotonic() - started)))
+
+
+@ftb_cli.command("restore")
+@click.argument("snapshot")
+@click.option("--yes", is_flag=True, help="Don't ask for confirmation.")
+def restore_command(snapshot, yes):
+    """Replace the live DB with SNAPSHOT (a path, a file name, or 'latest')."""
+    if snapshot == "latest":
+        snapshots = list_snapshots()
+        if not snapshots:
+            raise click.ClickException(f"no snapshots in {BACKUP_DIR}")
+        snapshot = snapshots[-1]
+    elif not os.path.exists(snapshot):
+        snapshot = os.path.join(BACKUP_DIR, snapshot)
+    if not os.path.exists(snapshot):
+        raise click.ClickException(f"{snapshot} not found")
+
+    if not yes:
+        click.confirm(f"Overwrite {DB_PATH} with {snapshot}?", abort=True)
+
+    missing = restore_snapshot(snapshot)
+    click.echo(f"restored {snapshot}")
+    for path in missing:
+        click.echo(f"  missing upload: {path}")
+
+
+# ============================================================
+# Upload storage accounting + orphan GC
+# ============================================================
+# Old avatars and files from abandoned showcase posts are never deleted by
+# the request path. `flask ftb storage` builds the set of referenced paths
+# (DB + retained backup manifests), walks static/uploads with os.scandir and
+# reports usage; with --gc it deletes unreferenced files past a grace period.
+STORAGE_GRACE_HOURS = 24
+STORAGE_DELETE_BATCH = 500
+STORAGE_PROGRESS_EVERY = 10000
+
+
+def walk_uploads(root):
+    # iterative scandir: no per-file stat beyond the one DirEntry caches
+    stack = [root]
+    while stack:
+        try:
+            it = os.scandir(stack.pop())
+        except FileNotFoundError:
+            continue
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry
+
+
+def backup_upload_refs():
+    # files a retained snapshot would need back after a restore
+    refs = set()
+    for snapshot in list_snapshots():
+        try:
+            with open(manifest_path(snapshot)) as f:
+                refs.update(u["path"] for u in json.load(f).get("uploads", []))
+        except (OSError, ValueError):
+            continue
+    return refs
+
+
+def delete_files(paths):
+    deleted = 0
+    for path in paths:
+        try:
+            os.remove(path)
+            deleted += 1
+        except FileNotFoundError:
+            pass
+    return deleted
+
+
+@ftb_cli.command("storage")
+@click.option("--gc", is_flag=True, help="Delete orphaned uploads older than the grace period.")
+@click.option("--dry-run", is_flag=True, help="With --gc, report what would be deleted without deleting.")
+@click.option("--grace-hours", type=float, default=STORAGE_GRACE_HOURS, show_default=True)
+@click.option("--top", type=int, default=20, show_default=True, help="Users/showcases to list by usage.")
+def storage_command(gc, dry_run, grace_hours, top):
+    """Report static/uploads usage per user and showcase, and find orphans."""
+    owners = {}
+    conn = db()
+    for kind, owner_id, path in iter_upload_owners(conn):
+        owners.setdefault(path, []).append((kind, owner_id))
+    conn.close()
+    kept_for_backups = backup_upload_refs()
+
+    cutoff = time.time() - grace_hours * 3600
+    usage = {}
+    seen = set()
+    scanned = total_bytes = 0
+    orphan_files = orphan_bytes = young_orphans = 0
+    deleted = deleted_bytes = 0
+    batch = []
+
+    def flush():
+        nonlocal deleted, batch
+        if not dry_run:
+            deleted += delete_files(batch)
+        batch = []
+
+    for entry in walk_uploads(UPLOAD_FOLDER):
+        scanned += 1
+        size = entry.stat(follow_symlinks=False).st_size
+        total_bytes += size
+        rel = os.path.relpath(entry.path, app.static_folder).replace(os.sep, "/")
+
+        if rel in owners:
+            seen.add(rel)
+            for owner in owners[rel]:
+                usage[owner] = usage.get(owner, 0) + size
+        elif rel not in kept_for_backups:
+            orphan_files += 1
+            orphan_bytes += size
+            if entry.stat(follow_symlinks=False).st_mtime >= cutoff:
+                young_orphans += 1
+            elif gc:
+                batch.append(entry.path)
+                deleted_bytes += size
+                if len(batch) >= STORAGE_DELETE_BATCH:
+                    flush()
+
+        if scanned % STORAGE_PROGRESS_EVERY == 0:
+            click.echo(f"  scanned {scanned} files, {orphan_files} orphans so far", err=True)
+    if batch:
+        flush()
+
+    click.echo(f"uploads: {scanned} files, {total_bytes} bytes")
+    click.echo(f"referenced: {len(seen)} files; missing on disk: {len(set(owners) - seen)}")
+    click.echo(
+        f"orphans: {orphan_files} files, {orphan_bytes} bytes "
+        f"({young_orphans} inside the {grace_hours:g}h grace period)"
+    )
+    for kind in ("user", "showcase"):
+        ranked = sorted(((b, oid) for (k, oid), b in usage.items() if k == kind), reverse=True)[:top]
+        if ranked:
+            click.echo(f"top {kind}s by bytes:")
+            for nbytes, oid in ranked:
+                click.echo(f"  {kind} {oid}: {nbytes}")
+    if gc:
+        if dry_run:
+            click.echo(f"dry run: would delete {orphan_files - young_orphans} files, {deleted_bytes} bytes")
+        else:
+            click.echo(f"deleted {deleted} files, {deleted_bytes} bytes")
+
+
+# ============================================================
+# Static asset pipeline (fingerprints + precompression)
+# ============================================================
+# `flask ftb assets` copies static files to static/build/ under
+# content-hashed names, writes .gz siblings for text assets, recompresses the
+# landing photos and records everything in build/manifest.json. Once that
+# manifest exists, url_for('static', ...) resolves to the fingerprinted name,
+# which is served with a one-year immutable Cache-Control (and gzipped when
+# the client accepts it). Without a build, stable names are served as before.
+ASSET_BUILD_SUBDIR = "build"
+ASSET_MANIFEST = os.path.join(app.static_folder, ASSET_BUILD_SUBDIR, "manifest.json")
+ASSET_SKIP_DIRS = {UPLOAD_SUBDIR, ASSET_BUILD_SUBDIR}
+ASSET_GZIP_EXTS = {".css", ".js", ".svg", ".json", ".txt", ".html", ".map"}
+ASSET_IMAGE_DIRS = ("landing", "img")
+ASSET_IMAGE_MAX_WIDTH = 1600
+ASSET_IMAGE_QUALITY = 82
+ASSET_MAX_AGE = 365 * 24 * 3600
+
+_asset_manifest = None
+
+
+def asset_manifest():
+    # read lazily, once per process (nothing at import time)
+    global _asset_manifest
+    if _asset_manifest is None:
+        try:
+            with open(ASSET_MANIFEST) as f:
+                _asset_manifest = json.load(f)
+        except (OSError, ValueError):
+            _asset_manifest = {}
+    return _asset_manifest
+
+
+@app.url_defaults
+def fingerprint_static(endpoint, values):
+    if endpoint == "static" and values.get("filename"):
+        built = asset_manifest().get(values["filename"])
+        if built:
+            values["filename"] = built
+
+
+def serve_static(filename):
+    if not filename.startswith(ASSET_BUILD_SUBDIR + "/"):
+        return app.send_static_file(filename)
+
+    # the name changes whenever the bytes do, so it can be cached forever
+    gz = filename + ".gz"
+    if request.accept_encodings["gzip"] > 0 and os.path.isfile(os.path.join(app.static_folder, gz)):
+        resp = send_from_directory(
+            app.static_folder,
+            gz,
+            mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream",
+            max_age=ASSET_MAX_AGE,
+        )
+        resp.headers["Content-Encoding"] = "gzip"
+        resp.headers.pop("Content-Disposition", None)
+    else:
+        resp = send_from_directory(app.static_folder, filename, max_age=ASSET_MAX_AGE)
+    resp.headers["Vary"] = "Accept-Encoding"
+    resp.cache_control.immutable = True
+    return resp
+
+
+app.view_functions["static"] = serve_static
+
+
+def recompress_image(data):
+    # optional: only when Pillow is installed; returns None to keep the original
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    import io
+
+    img = Image.open(io.BytesIO(data))
+    if img.format != "JPEG":
+        return None
+    if img.width > ASSET_IMAGE_MAX_WIDTH:
+        img = img.resize((ASSET_IMAGE_MAX_WIDTH, round(img.height * ASSET_IMAGE_MAX_WIDTH / img.width)), Image.LANCZOS)
+    out = io.BytesIO()
+    img.convert("RGB").save(out, "JPEG", quality=ASSET_IMAGE_QUALITY, optimize=True, progressive=True)
+    smaller = out.getvalue()
+    return smaller if len(smaller) < len(data) else None
+
+
+def write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "wb") as f:
+        f.write(data)
+    os.replace(path + ".tmp", path)
+
+
+@ftb_cli.command("assets")
+@click.option("--prune", is_flag=True, help="Delete build files the new manifest no longer uses.")
+def assets_command(prune):
+    """Fingerprint, precompress and manifest the static files."""
+    global _asset_manifest
+
+    static = app.static_folder
+    build = os.path.join(static, ASSET_BUILD_SUBDIR)
+    manifest = {}
+    saved = 0
+    for dirpath, dirnames, filenames in os.walk(static):
+        if dirpath == static:
+            dirnames[:] = [d for d in dirnames if d not in ASSET_SKIP_DIRS]
+        for name in filenames:
+            src = os.path.join(dirpath, name)
+            rel = os.path.relpath(src, static).replace(os.sep, "/")
+            with open(src, "rb") as f:
+                data = f.read()
+
+            if rel.split("/", 1)[0] in ASSET_IMAGE_DIRS:
+                smaller = recompress_image(data)
+                if smaller:
+                    saved += len(data) - len(smaller)
+                    data = smaller
+
+            stem, ext = os.path.splitext(rel)
+            built = f"{ASSET_BUILD_SUBDIR}/{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+            out = os.path.join(static, built)
+            if not os.path.exists(out):
+                write_atomic(out, data)
+            if ext.lower() in ASSET_GZIP_EXTS and not os.path.exists(out + ".gz"):
+                # mtime=0 keeps the .gz bytes (and so its ETag) stable across builds
+                packed = gzip.compress(data, compresslevel=9, mtime=0)
+                if len(packed) < len(data):
+                    write_atomic(out + ".gz", packed)
+            manifest[rel] = built
+
+    write_atomic(ASSET_MANIFEST, json.dumps(manifest, indent=2, sort_keys=True).encode())
+    _asset_manifest = manifest
+
+    removed = 0
+    if prune:
+        keep = {os.path.join(static, b) for b in manifest.values()}
+        keep |= {k + ".gz" for k in keep} | {ASSET_MANIFEST}
+        for dirpath, _, filenames in os.walk(build):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                if path not in keep:
+                    os.remove(path)
+                    removed += 1
+
+    click.echo(f"{len(manifest)} assets -> {ASSET_MANIFEST}")
+    if saved:
+        click.echo(f"recompressed images saved {saved} bytes")
+    if removed:
+        click.echo(f"pruned {removed} stale build files")
+
+
+# ============================================================
+# Query-plan checks
+# ============================================================
+# `flask ftb plancheck` requests every hot route against a seeded scratch DB,
+# captures each SELECT it issues and runs EXPLAIN QUERY PLAN on it. A full
+# SCAN of a large table or a temp B-tree sort fails the check unless the
+# route + plan step is listed in query_plans.allow.
+PLAN_ALLOWLIST = os.path.join(BASE_DIR, "query_plans.allow")
+PLAN_LARGE_TABLES = {"users", "showcases", "messages"}
+PLAN_ROUTES = (
+    "/",
+    "/c/artist",
+    "/c/production/producer",
+    "/c/showcases",
+    "/s/1",
+    "/s/1/calendar.ics",
+    "/u/1",
+    "/profile",
+    "/inbox",
+    "/messages/new",
+    "/messages/u1_u2",
+    "/api/v1/people",
+    "/api/v1/people?cursor={people_cursor}",
+    "/api/v1/users/1",
+    "/api/v1/showcases",
+    "/api/v1/showcases?cursor={showcase_cursor}",
+    "/api/v1/showcases?host=1",
+    "/api/v1/showcases/1",
+    "/api/v1/inbox",
+    "/api/v1/threads/u1_u2",
+    "/api/v1/threads/u1_u2?cursor={thread_cursor}",
+)
+
+
+def seed_plan_db(users=2000, showcases=2000, messages=20000):
+    init_app()
+    conn = db()
+    conn.executemany(
+        "INSERT INTO users (display_name, city, state, services_csv) VALUES (?, 'Jackson', 'MS', 'producer')",
+        [(f"user {i}",) for i in range(users)],
+    )
+    conn.executemany(
+        "INSERT INTO showcases (title, event_date, host_user_id, created_at) VALUES (?, ?, ?, '')",
+        [(f"show {i}", f"2026-{i % 12 + 1:02d}-{i % 28 + 1:02d}", i % users + 1) for i in range(showcases)],
+    )
+    conn.executemany(
+        """
+        INSERT INTO messages (thread_key, from_user_id, to_user_id, body, created_at)
+        VALUES (?, ?, ?, 'hey', ?)
+        """,
+        [
+            (f"u1_u{i % users + 1}", 1 if i % 2 else i % users + 1, i % users + 1 if i % 2 else 1, f"2026-01-01T00:{i:06d}")
+            for i in range(messages)
+        ],
+    )
+    conn.commit()
+    conn.close()
+
+
+def plan_step(text):
+    # SQLite before 3.36 prints "SCAN TABLE users" where newer ones print "SCAN users"
+    return re.sub(r"^(SCAN|SEARCH) TABLE ", r"\1 ", text.strip())
+
+
+def load_plan_allowlist():
+    allowed = set()
+    if os.path.exists(PLAN_ALLOWLIST):
+        with open(PLAN_ALLOWLIST) as f:
+            for line in f:
+                line = line.split("#", 1)[0].strip()
+                if line:
+                    route, step = line.split(None, 1)
+                    allowed.add((route, plan_step(step)))
+    return allowed
+
+
+def plan_problems(conn, sql):
+    # aliases ("FROM messages m") show up in plans under the alias
+    large = set(PLAN_LARGE_TABLES)
+    for table, alias in re.findall(r"\b(?:FROM|JOIN)\s+(\w+)\s+(?:AS\s+)?(\w+)", sql, re.I):
+        if table in PLAN_LARGE_TABLES:
+            large.add(alias)
+
+    steps = [plan_step(row[3]) for row in conn.execute("EXPLAIN QUERY PLAN " + sql)]
+    sorts = [s for s in steps if "TEMP B-TREE" in s]
+    scans = [s for s in steps if re.match(r"SCAN (\w+)", s) and re.match(r"SCAN (\w+)", s).group(1) in large]
+    # a scan with no sort is walking the ORDER BY's index (or the rowid), so
+    # under LIMIT it stops early -- unless a WHERE filters the rows it walks,
+    # in which case it may read the whole table to fill the page
+    if (scans and not sorts and re.search(r"\bORDER BY\b", sql, re.I)
+            and re.search(r"\bLIMIT\b", sql, re.I) and not re.search(r"\bWHERE\b", sql, re.I)):
+        scans = []
+    return steps, scans + sorts
+
+
+@ftb_cli.command("plancheck")
+@click.option("--verbose", is_flag=True, help="Print every captured statement and its plan.")
+def plancheck_command(verbose):
+    """Fail if a hot route's SQL full-scans a large table or sorts in a temp B-tree."""
+    global DB_PATH
+
+    import tempfile
+
+    workdir = tempfile.mkdtemp(prefix="ftb-plancheck-")
+    live_path = DB_PATH
+    DB_PATH = os.path.join(workdir, "plancheck.db")
+    user_cache.clear()
+    try:
+        seed_plan_db()
+        allowed = load_plan_allowlist()
+        cursors = {
+            "people_cursor": encode_cursor([1000]),
+            "showcase_cursor": encode_cursor(["2026-06-15", 1000]),
+            "thread_cursor": encode_cursor(["2026-01-01T00:000100", 100]),
+        }
+
+        captured = []
+        app.config["FTB_SQL_TRACE"] = captured.append
+        client = app.test_client()
+        failures, used = [], set()
+        explain = sqlite3.connect(DB_PATH)
+        for pattern in PLAN_ROUTES:
+            url = pattern.format(**cursors)
+            route = pattern.split("?", 1)[0]
+            captured.clear()
+            user_cache.clear()
+            status = client.get(url).status_code
+            if status >= 400:
+                failures.append(f"{url}: HTTP {status}")
+            for sql in dict.fromkeys(captured):
+                if not re.match(r"\s*(SELECT|WITH)\b", sql, re.I):
+                    continue
+                steps, problems = plan_problems(explain, sql)
+                if verbose:
+                    click.echo(f"{url}\n  {' '.join(sql.split())}")
+                    for step in steps:
+                        click.echo(f"    {step}")
+                for step in problems:
+                    if (route, step) in allowed:
+                        used.add((route, step))
+                    else:
+                        failures.append(f"{url}: {step}\n    {' '.join(sql.split())}")
+        explain.close()
+    finally:
+        app.config.pop("FTB_SQL_TRACE", None)
+        DB_PATH = live_path
+        user_cache.clear()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    for route, step in sorted(allowed - used):
+        click.echo(f"stale allowlist entry: {route} {step}")
+    if failures:
+        click.echo("\n".join(failures), err=True)
+        raise click.ClickException(f"{len(failures)} query-plan regression(s)")
+    click.echo(f"query plans OK ({len(PLAN_ROUTES)} routes)")
+
+
 # ============================================================
 # Run
 # ============================================================
-# --- Render / Gunicorn safe startup init ---
 def init_app():
+    # one-time setup: `flask ftb init`, or the gunicorn master (gunicorn.conf.py)
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
     ensure_db()
     ensure_showcases_schema()
     ensure_messages_schema()
 
-init_app()
+
+def create_app(config=None):
+    # no DB or filesystem work here, so it is safe to call before fork()
+    if config:
+        app.config.update(config)
+    return app
+
+
+@ftb_cli.command("init")
+def init_command():
+    """Create the upload folder and DB schema, and seed the first user."""
+    init_app()
+    click.echo(f"initialized {DB_PATH}")
+
 
 if __name__ == "__main__":
-    ensure_db()
-    ensure_showcases_schema()
-    ensure_messages_schema()
+    init_app()
     port = int(os.environ.get("PORT", 5000))
     app.run(host="0.0.0.0", port=port)
 
-if __name__ == "__main__":
-    ensure_db()
-    app.run()
-
@@ -0,0 +1,57 @@
+"""Startup-time benchmark: import cost and first-request latency.
+
+Each run happens in a fresh interpreter so nothing is warm:
+
+    python bench_startup.py [runs]
+
+Set FTB_DB_PATH to point at a scratch database; it is initialized first.
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+PROBE = r"""
+import json, time
+t0 = time.perf_counter()
+import app as ftb
+t1 = time.perf_counter()
+flask_app = ftb.create_app()
+client = flask_app.test_client()
+t2 = time.perf_counter()
+first = client.get("/")
+t3 = time.perf_counter()
+client.get("/")
+t4 = time.perf_counter()
+assert first.status_code == 200, first.status_code
+print(json.dumps({
+    "import_ms": (t1 - t0) * 1000,
+    "create_app_ms": (t2 - t1) * 1000,
+    "first_request_ms": (t3 - t2) * 1000,
+    "second_request_ms": (t4 - t3) * 1000,
+}))
+"""
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    subprocess.run([sys.executable, "-c", "import app; app.init_app()"], cwd=here, check=True)
+
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", PROBE], cwd=here, check=True, capture_output=True, text=True
+        ).stdout
+        samples.append(json.loads(out.strip().splitlines()[-1]))
+
+    print(f"startup over {runs} fresh interpreters (median / max, ms)")
+    for key in samples[0]:
+        values = [s[key] for s in samples]
+        print(f"  {key:<18} {statistics.median(values):8.1f} {max(values):8.1f}")
+
+
+if __name__ == "__main__":
+    main()
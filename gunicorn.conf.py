@@ -0,0 +1,34 @@
+# Gunicorn settings for Find the Beat (picked up automatically from the cwd).
+#
+# The app is imported once in the master (preload) and workers are forked
+# from it. One-time DB setup runs in the master before any worker exists;
+# each worker opens its own SQLite connections after the fork.
+import os
+
+# the Render/Heroku router is one X-Forwarded-For hop in front of us; without
+# this every request's remote_addr is the router and the per-client rate
+# limits collapse into one site-wide bucket. Set FTB_PROXY_HOPS=0 when
+# serving directly. Must be set before preload imports the app.
+os.environ.setdefault("FTB_PROXY_HOPS", "1")
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+# threaded workers: each process's writer thread (app.WriteQueue) only gets
+# to group-commit when several request threads write at once
+worker_class = "gthread"
+threads = int(os.environ.get("FTB_WORKER_THREADS", "8"))
+preload_app = True
+
+
+def on_starting(server):
+    from app import init_app
+
+    init_app()
+
+
+def post_fork(server, worker):
+    from app import user_cache
+
+    # anything cached in the master is stale by the time a worker serves;
+    # the writer thread restarts itself lazily in the new pid
+    user_cache.clear()